@@ -28,8 +28,10 @@ try:
     if TYPE_CHECKING:
         from internalblue.hci import HCI
         from internalblue.core import InternalBlue
+        from internalblue.adbcore import _LazyTime
 
-        Record = Tuple[HCI, int, int, int, Any, datetime.datetime]
+        # ADBCore passes a _LazyTime timestamp, which behaves like the datetime
+        Record = Tuple[HCI, int, int, int, Any, Union[datetime.datetime, _LazyTime]]
         FilterFunction = Callable[[Record], bool]
 
         Opcode = NewType("Opcode", int)
@@ -1,13 +1,16 @@
 #!/usr/bin/env python2
 import struct
 import threading
-from time import sleep
-from typing import Optional
+from functools import total_ordering
+from itertools import chain
+from time import sleep, monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
 
 import datetime
+import logging
 import socket
 import queue as queue2k
-import random
+import selectors
 
 from ppadb.device import Device
 from ppadb.connection import Connection
@@ -15,9 +18,125 @@ from ppadb.client import Client as AdbClient
 
 from . import hci
 from .utils import bytes_to_hex
-from .utils.packing import u32
 from .core import InternalBlue
 
+if TYPE_CHECKING:
+    from internalblue import FilterFunction, Record
+
+# btsnoop file header (identification pattern, version, datalink type) and
+# btsnoop record header (original length, included length, flags, drops, timestamp).
+# See RFC 1761.
+_BTSNOOP_FILE_HDR_STRUCT = struct.Struct(">8sII")
+_RECORD_HDR_STRUCT = struct.Struct(">IIIIq")
+
+# The btsnoop log file is flushed after this many records or after this many
+# seconds, whichever comes first. If the link goes idle, the recvThread wakes up
+# to flush records that are still pending once the interval has passed.
+_BTSNOOP_FLUSH_RECORDS = 64
+_BTSNOOP_FLUSH_INTERVAL = 0.25
+
+# While recv queues are full, only every this many dropped records is logged
+_DROP_WARNING_INTERVAL = 100
+
+# Records waiting for the callbacks registered with inline=False. Further records
+# are dropped for these callbacks, like for a full recv queue.
+_DEFERRED_CALLBACK_QUEUE_SIZE = 1000
+
+# Not available on all platforms (e.g. Windows), _recvRecordPart() then always waits
+# for s_snoop to become readable before receiving.
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+# Socket buffer size for s_snoop and s_inject, so that bursts of HCI traffic are
+# buffered by the kernel instead of being dropped.
+_SOCKET_BUFFER_SIZE = 1 << 20
+
+# btsnoop timestamps count microseconds since midnight, January 1st 0 AD. This is
+# midnight, January 1st 2000 AD in that representation.
+_BTSNOOP_EPOCH_US = 0x00E03AB44A676000
+_BTSNOOP_EPOCH_DT = datetime.datetime(2000, 1, 1)
+
+
+def _btsnoop_parse_time(time):
+    """
+    Taken from: https://github.com/joekickass/python-btsnoop
+
+    Record time is a 64-bit signed integer representing the time of packet arrival,
+    in microseconds since midnight, January 1st, 0 AD nominal Gregorian.
+
+    In order to avoid leap-day ambiguity in calculations, note that an equivalent
+    epoch may be used of midnight, January 1st 2000 AD, which is represented in
+    this field as 0x00E03AB44A676000.
+    """
+    return _BTSNOOP_EPOCH_DT + datetime.timedelta(
+        microseconds=time - _BTSNOOP_EPOCH_US
+    )
+
+
+@total_ordering
+class _LazyTime(object):
+    """
+    Timestamp of a received btsnoop record. The raw timestamp is only converted
+    to a datetime (see _btsnoop_parse_time) once it is accessed, so records nobody
+    looks at the time of do not pay for the conversion.
+
+    .value is the datetime, or None if the raw timestamp is out of range. Public
+    attribute access (e.g. .second, .microsecond), str(), comparisons and hashing
+    are forwarded to .value, and the object is falsy if .value is None. It can be
+    copied and pickled. Datetime arithmetic and isinstance() checks need .value.
+    """
+
+    __slots__ = ("_us", "_cached", "_parsed")
+
+    def __init__(self, us):
+        # type: (int) -> None
+        self._us = us
+        self._cached = None  # type: Optional[datetime.datetime]
+        self._parsed = False
+
+    @property
+    def value(self):
+        # type: () -> Optional[datetime.datetime]
+        if not self._parsed:
+            try:
+                self._cached = _btsnoop_parse_time(self._us)
+            except OverflowError:
+                self._cached = None
+            self._parsed = True
+        return self._cached
+
+    def __getattr__(self, name):
+        # Only called for names that are not found otherwise. Private names (e.g. the
+        # slots of an instance that copy or pickle created without __init__) are not
+        # forwarded, value would look them up again.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __reduce__(self):
+        return _LazyTime, (self._us,)
+
+    def __eq__(self, other):
+        if isinstance(other, _LazyTime):
+            other = other.value
+        return self.value == other
+
+    def __lt__(self, other):
+        if isinstance(other, _LazyTime):
+            other = other.value
+        return self.value < other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __bool__(self):
+        return self.value is not None
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return repr(self.value)
+
 
 class ADBCore(InternalBlue):
     def __init__(
@@ -38,9 +157,35 @@ class ADBCore(InternalBlue):
         )
 
         # Connect to adb device
-        self.hciport: Optional[int] = None  # hciport is the port number of the forwarded HCI snoop port (8872). The inject port is at hciport+1
+        self.hciport: Optional[int] = None  # hciport is the port number of the forwarded HCI snoop port (8872)
+        self.injectport: Optional[int] = None  # injectport is the port number of the forwarded HCI inject port (8873)
         self.serial = serial  # use serial su busybox scripting and do not try bluetooth.default.so
         self.doublecheck = False
+        # The recvThread waits on _selector for s_snoop to become readable. shutdown()
+        # wakes it up by writing to _wake_w, so no timeout is needed for that. The only
+        # timeout is the one for flushing records still buffered for the btsnoop log.
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wake_r: Optional[socket.socket] = None
+        self._wake_w: Optional[socket.socket] = None
+        # Records written to btsnooplog_file since the last flush, and when that was
+        self._unflushedRecords = 0
+        self._lastFlush = monotonic()
+        # Callbacks registered with inline=False. The recvThread hands them to a
+        # worker thread instead of calling them itself (see registerHciCallback()).
+        self._deferredHciCallbacks: Set = set()
+        # registeredHciRecvQueues split up for the recvThread (see _updateHciRecvDispatch()):
+        # queues with an arbitrary filter function, and queues registered with hci_types
+        # indexed by HCI packet type together with their remaining filter function.
+        self._hciRecvDispatch = (
+            [],
+            {},
+        )  # type: Tuple[List[Tuple[queue2k.Queue[Record], FilterFunction]], Dict[int, List[Tuple[queue2k.Queue[Record], FilterFunction]]]]
+        # Held while registeredHciRecvQueues is modified and _hciRecvDispatch is rebuilt
+        # from it, so that concurrent registrations cannot publish a stale dispatch table.
+        self._hciRecvQueuesLock = threading.Lock()
+        # adb connections running the shell commands of _setupSerialSu(). The commands
+        # keep running as long as their connection is open.
+        self._serialConnections: List[Connection] = []
         self.client = AdbClient(host="127.0.0.1", port=5037)
 
     def device(self) -> Device:
@@ -131,30 +276,148 @@ class ADBCore(InternalBlue):
             self.btsnooplog_file.write(data)
             self.btsnooplog_file.flush()
 
-        btsnoop_hdr = (
-            data[:8],
-            u32(data[8:12], endian="big"),
-            u32(data[12:16], endian="big"),
-        )
+        btsnoop_hdr = _BTSNOOP_FILE_HDR_STRUCT.unpack(data)
         self.logger.debug("BT Snoop Header: %s, version: %d, data link type: %d" % btsnoop_hdr)
         return btsnoop_hdr
 
-    def _btsnoop_parse_time(self, time):
+    def registerHciCallback(self, callback, inline=True):
+        # type: (Callable[[Record], None], bool) -> None
+        """
+        Add a new callback function to self.registeredHciCallbacks
+        (see InternalBlue.registerHciCallback()).
+        If inline is False, the recvThread does not call the callback itself but
+        hands the records to a worker thread, so that a slow callback does not
+        stall receiving. The callback still gets the records in order. If the
+        worker falls behind by _DEFERRED_CALLBACK_QUEUE_SIZE records, further
+        records are dropped for the deferred callbacks and a warning is logged.
         """
-        Taken from: https://github.com/joekickass/python-btsnoop
 
-        Record time is a 64-bit signed integer representing the time of packet arrival,
-        in microseconds since midnight, January 1st, 0 AD nominal Gregorian.
+        if not inline and callback not in self.registeredHciCallbacks:
+            self._deferredHciCallbacks.add(callback)
+        super(ADBCore, self).registerHciCallback(callback, inline)
+
+    def unregisterHciCallback(self, callback):
+        # type: (Callable[[Record], None]) -> None
+        super(ADBCore, self).unregisterHciCallback(callback)
+        self._deferredHciCallbacks.discard(callback)
+
+    def registerHciRecvQueue(self, queue, filter_function=None, hci_types=None):
+        # type: (queue2k.Queue[Record], FilterFunction, Optional[Iterable[int]]) -> None
+        with self._hciRecvQueuesLock:
+            super(ADBCore, self).registerHciRecvQueue(queue, filter_function, hci_types)
+            self._updateHciRecvDispatch()
+
+    def unregisterHciRecvQueue(self, queue):
+        # type: (queue2k.Queue[Record]) -> None
+        with self._hciRecvQueuesLock:
+            super(ADBCore, self).unregisterHciRecvQueue(queue)
+            self._updateHciRecvDispatch()
+
+    def _updateHciRecvDispatch(self):
+        # type: () -> None
+        """
+        Rebuild _hciRecvDispatch from registeredHciRecvQueues. Queues registered
+        with hci_types are only looked at by the recvThread for packets of these
+        types, so their type check does not run for every packet.
+        Must be called with _hciRecvQueuesLock held.
+        The recvThread picks up the new dispatch tables with its next record.
+        """
 
-        In order to avoid leap-day ambiguity in calculations, note that an equivalent
-        epoch may be used of midnight, January 1st 2000 AD, which is represented in
-        this field as 0x00E03AB44A676000.
+        filtered_queues = []
+        queues_by_type = {}  # type: Dict[int, List[Tuple[queue2k.Queue[Record], FilterFunction]]]
+        for queue, filter_function in self.registeredHciRecvQueues:
+            if isinstance(filter_function, hci.HciTypeFilter):
+                for hci_type in filter_function.hci_types:
+                    queues_by_type.setdefault(hci_type, []).append(
+                        (queue, filter_function.filter_function)
+                    )
+            else:
+                filtered_queues.append((queue, filter_function))
+        self._hciRecvDispatch = (filtered_queues, queues_by_type)
+
+    def _deferredCallbackThreadFunc(self, work_queue):
+        # type: (queue2k.Queue[Optional[Tuple[Callable[[Record], None], Record]]]) -> None
+        """
+        Run-function of the worker thread which calls the callbacks registered with
+        inline=False. It stops when the recvThread puts None into work_queue.
         """
-        time_betw_0_and_2000_ad = int("0x00E03AB44A676000", 16)
-        time_since_2000_epoch = datetime.timedelta(
-            microseconds=time
-        ) - datetime.timedelta(microseconds=time_betw_0_and_2000_ad)
-        return datetime.datetime(2000, 1, 1) + time_since_2000_epoch
+
+        while True:
+            work = work_queue.get()
+            if work is None:
+                break
+            callback, record = work
+            try:
+                callback(record)
+            except Exception as e:
+                self.logger.warning(
+                    "recvThreadFunc: Callback %s failed with %r" % (callback, e)
+                )
+
+    def _flushBtsnoopLog(self):
+        # type: () -> None
+        self.btsnooplog_file.flush()
+        self._unflushedRecords = 0
+        self._lastFlush = monotonic()
+
+    def _recvRecordPart(self, view):
+        # type: (memoryview) -> int
+        """
+        Receive len(view) bytes from the s_snoop socket into view. Returns the
+        number of bytes received, which is less than len(view) if the socket was
+        closed by the remote site or exit_requested was set in the meantime.
+        """
+
+        size = len(view)
+        received = 0
+
+        # Fast path: most of the time the whole record header or record is already
+        # buffered by the kernel and can be read without waiting on the selector.
+        # Otherwise, the loop below continues with whatever was received here.
+        if not self.replay and _MSG_DONTWAIT:
+            try:
+                received = self.s_snoop.recv_into(view, size, _MSG_DONTWAIT)
+            except BlockingIOError:
+                pass
+            if received == size:
+                return received
+
+        while not self.exit_requested and received < size:
+            if self.replay:
+                # The ReplaySocket (see socket_hooks.py) has no file descriptor to
+                # wait for and raises socket.timeout while there is nothing to replay.
+                try:
+                    recv_len = self.s_snoop.recv_into(view[received:], size - received)
+                except socket.timeout:
+                    if self._unflushedRecords:
+                        self._flushBtsnoopLog()
+                    continue
+            else:
+                # Without pending btsnoop log records, wait until there is something to
+                # receive. Otherwise, wake up in time to flush them if the link goes idle,
+                # instead of leaving them in the write buffer until the next record.
+                timeout = None
+                if self._unflushedRecords:
+                    timeout = max(
+                        0.0, _BTSNOOP_FLUSH_INTERVAL - (monotonic() - self._lastFlush)
+                    )
+                events = self._selector.select(timeout)
+                if not events:
+                    self._flushBtsnoopLog()
+                    continue
+                if any(key.fileobj is self._wake_r for key, _ in events):
+                    break  # woken up by shutdown()
+                # No MSG_WAITALL: it would block until the rest of a partially
+                # received record arrives, and shutdown() could not wake us up.
+                recv_len = self.s_snoop.recv_into(view[received:], size - received)
+            if recv_len == 0:
+                self.logger.info(
+                    "recvThreadFunc: bt_snoop socket was closed by remote site. stopping recv thread..."
+                )
+                self.exit_requested = True
+                break
+            received += recv_len
+        return received
 
     def _recvThreadFunc(self):
         """
@@ -168,99 +431,129 @@ class ADBCore(InternalBlue):
 
         self.logger.debug("Receive Thread started.")
 
+        # The record header and record data are received into buffers which are
+        # allocated once and reused for every record. The data buffer only grows
+        # if a record does not fit into it.
+        self._hdr_buf = bytearray(24)
+        self._data_buf = bytearray(4096)
+        hdr_view = memoryview(self._hdr_buf)
+        self._unflushedRecords = 0
+        self._lastFlush = monotonic()
+        dropped_records = 0
+
+        # registerHciCallback/unregisterHciCallback only modify these in place, so local
+        # references stay valid for the lifetime of the thread.
+        callbacks = self.registeredHciCallbacks
+        deferred_callbacks = self._deferredHciCallbacks
+
+        # A single worker keeps the records in order for the deferred callbacks,
+        # e.g. the StackDumpReceiver reassembles dumps from consecutive packets.
+        callback_queue = queue2k.Queue(
+            _DEFERRED_CALLBACK_QUEUE_SIZE
+        )  # type: queue2k.Queue[Optional[Tuple[Callable[[Record], None], Record]]]
+        callback_thread = threading.Thread(
+            target=self._deferredCallbackThreadFunc,
+            args=(callback_queue,),
+            name="HciCallback",
+        )
+        callback_thread.daemon = True
+        callback_thread.start()
+        dropped_callbacks = 0
+
         while not self.exit_requested:
             # Read the record header
-            record_hdr = b""
-            while not self.exit_requested and len(record_hdr) < 24:
-                try:
-                    recv_data = self.s_snoop.recv(24 - len(record_hdr))
-                    self.logger.debug(
-                        "recvThreadFunc: received bt_snoop data "
-                        + bytes_to_hex(recv_data)
-                    )
-                    if len(recv_data) == 0:
-                        self.logger.info(
-                            "recvThreadFunc: bt_snoop socket was closed by remote site. stopping recv thread..."
-                        )
-                        self.exit_requested = True
-                        break
-                    record_hdr += recv_data
-                except socket.timeout:
-                    pass  # this is ok. just try again without error
-
-            if not record_hdr or len(record_hdr) != 24:
+            if self._recvRecordPart(hdr_view) != 24:
                 if not self.exit_requested:
                     self.logger.warning("recvThreadFunc: Cannot recv record_hdr. stopping.")
                     self.exit_requested = True
                 break
 
-            if self.write_btsnooplog:
-                self.btsnooplog_file.write(record_hdr)
-                self.btsnooplog_file.flush()
-
-            orig_len, inc_len, flags, drops, time64 = struct.unpack(
-                ">IIIIq", record_hdr
+            orig_len, inc_len, flags, drops, time64 = _RECORD_HDR_STRUCT.unpack_from(
+                self._hdr_buf, 0
             )
+            if inc_len == 0:
+                # Every HCI packet has at least its packet type byte
+                self.logger.warning("recvThreadFunc: Received empty record. stopping.")
+                self.exit_requested = True
+                break
 
             # Read the record data
-            record_data = bytearray()
-            while not self.exit_requested and len(record_data) < inc_len:
-                try:
-                    recv_data = self.s_snoop.recv(inc_len - len(record_data))
-                    if len(recv_data) == 0:
-                        self.logger.info(
-                            "recvThreadFunc: bt_snoop socket was closed by remote site. stopping.."
-                        )
-                        self.exit_requested = True
-                        break
-                    record_data += bytearray(recv_data)
-                except socket.timeout:
-                    pass  # this is ok. just try again without error
-
-            if not record_data or len(record_data) != inc_len:
+            if inc_len > len(self._data_buf):
+                self._data_buf = bytearray(inc_len)
+            data_view = memoryview(self._data_buf)[:inc_len]
+            data_len = self._recvRecordPart(data_view)
+            if data_len != inc_len:
                 if not self.exit_requested:
                     self.logger.warning("recvThreadFunc: Cannot recv data. stopping.")
                     self.exit_requested = True
                 break
 
-            if self.write_btsnooplog:
-                self.btsnooplog_file.write(record_data)
-                self.btsnooplog_file.flush()
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    "recvThreadFunc: received bt_snoop record %s %s",
+                    bytes_to_hex(self._hdr_buf),
+                    bytes_to_hex(data_view),
+                )
 
-            try:
-                parsed_time = self._btsnoop_parse_time(time64)
-            except OverflowError:
-                parsed_time = None
+            if self.write_btsnooplog:
+                self.btsnooplog_file.writelines((self._hdr_buf, data_view))
+                self._unflushedRecords += 1
+                if (
+                    self._unflushedRecords >= _BTSNOOP_FLUSH_RECORDS
+                    or monotonic() - self._lastFlush > _BTSNOOP_FLUSH_INTERVAL
+                ):
+                    self._flushBtsnoopLog()
 
             # Put all relevant infos into a tuple. The HCI packet is parsed with the help of hci.py.
+            # The parsed packet keeps references to its data, so it gets its own
+            # copy instead of a view into the reused receive buffer.
             record = (
-                hci.parse_hci_packet(record_data),
+                hci.parse_hci_packet(bytearray(data_view)),
                 orig_len,
                 inc_len,
                 flags,
                 drops,
-                parsed_time,
+                _LazyTime(time64),
             )
 
             # self.logger.debug(
-            #     "_recvThreadFunc Recv: [" + str(parsed_time) + "] " + str(record[0])
+            #     "_recvThreadFunc Recv: [" + str(record[5]) + "] " + str(record[0])
             # )
 
             # Put the record into all queues of registeredHciRecvQueues if their
-            # filter function matches.
-            for queue, filter_function in self.registeredHciRecvQueues:
-                if filter_function == None or filter_function(record):
-                    try:
-                        queue.put(record, block=False)
-                    except queue2k.Full:
+            # filter function matches. Queues registered with hci_types are only
+            # considered for packets of these types (see _updateHciRecvDispatch()).
+            # This thread is the only producer, so a queue that is not full now
+            # cannot become full before put_nowait().
+            filtered_queues, queues_by_type = self._hciRecvDispatch
+            for queue, filter_function in chain(
+                filtered_queues, queues_by_type.get(record[0].uart_type, ())
+            ):
+                if filter_function is None or filter_function(record):
+                    if not queue.full():
+                        queue.put_nowait(record)
+                        continue
+                    if dropped_records % _DROP_WARNING_INTERVAL == 0:
                         self.logger.warning(
-                            "recvThreadFunc: A recv queue is full. dropping packets.."
+                            "recvThreadFunc: A recv queue is full. dropping packets.. (%d dropped so far)"
+                            % (dropped_records + 1)
                         )
+                    dropped_records += 1
 
             # Call all callback functions inside registeredHciCallbacks and pass the
             # record as argument.
-            for callback in self.registeredHciCallbacks:
-                callback(record)
+            for callback in callbacks:
+                if callback not in deferred_callbacks:
+                    callback(record)
+                elif not callback_queue.full():
+                    callback_queue.put_nowait((callback, record))
+                else:
+                    if dropped_callbacks % _DROP_WARNING_INTERVAL == 0:
+                        self.logger.warning(
+                            "recvThreadFunc: Deferred callbacks fall behind. dropping packets.. (%d dropped so far)"
+                            % (dropped_callbacks + 1)
+                        )
+                    dropped_callbacks += 1
 
             # Check if the stackDumpReceiver has noticed that the chip crashed.
             # if self.stackDumpReceiver and self.stackDumpReceiver.stack_dump_has_happened:
@@ -268,6 +561,13 @@ class ADBCore(InternalBlue):
             # self.logger.warning("recvThreadFunc: The controller sent a stack dump.")
             # self.exit_requested = True
 
+        # Let the deferred callbacks process the remaining records
+        callback_queue.put(None)
+        callback_thread.join()
+
+        if self.write_btsnooplog:
+            self.btsnooplog_file.flush()
+
         self.logger.debug("Receive Thread terminated.")
 
     def _setupSockets(self):
@@ -280,24 +580,31 @@ class ADBCore(InternalBlue):
 
         # In order to support multiple parallel instances of InternalBlue
         # (with multiple attached Android devices) we must not hard code the
-        # forwarded port numbers. Therefore we choose the port numbers
-        # randomly and hope that they are not already in use.
-        self.hciport = random.randint(
-            60000, 65534
-        )  # minus 1, as we are using hciport + 1
+        # forwarded port numbers. Therefore we let the OS pick two currently
+        # unused ports. Both probe sockets are bound at the same time so that
+        # they cannot get the same port.
+        probes = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in range(2)]
+        for probe in probes:
+            probe.bind(("127.0.0.1", 0))
+        self.hciport, self.injectport = [probe.getsockname()[1] for probe in probes]
+        for probe in probes:
+            probe.close()
         self.logger.debug(
-            "_setupSockets: Selected random ports snoop=%d and inject=%d"
-            % (self.hciport, self.hciport + 1)
+            "_setupSockets: Selected free ports snoop=%d and inject=%d"
+            % (self.hciport, self.injectport)
         )
 
         # Forward ports 8872 and 8873. Ignore self.logger.info() outputs by the adb function.
         self.device().forward(f"tcp:{self.hciport}", "tcp:8872")
-        self.device().forward(f"tcp:{self.hciport+1}", "tcp:8873")
+        self.device().forward(f"tcp:{self.injectport}", "tcp:8873")
 
-        # Connect to hci injection port
+        # Connect to hci injection port. HCI commands are small and should be
+        # sent right away, so Nagle's algorithm is disabled.
         self.s_inject = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s_inject.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _SOCKET_BUFFER_SIZE)
+        self.s_inject.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         try:
-            self.s_inject.connect(("127.0.0.1", self.hciport + 1))
+            self.s_inject.connect(("127.0.0.1", self.injectport))
             self.s_inject.settimeout(0.5)
         except socket.error:
             self.logger.warning("Could not connect to adb. Is your device authorized?")
@@ -305,7 +612,13 @@ class ADBCore(InternalBlue):
 
         # Connect to hci snoop log port
         self.s_snoop = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Set before connecting, so that the TCP window is negotiated accordingly
+        self.s_snoop.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _SOCKET_BUFFER_SIZE)
         self.s_snoop.connect(("127.0.0.1", self.hciport))
+        self.logger.debug(
+            "_setupSockets: snoop socket receive buffer is %d bytes"
+            % self.s_snoop.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        )
         self.s_snoop.settimeout(0.5)
 
         # Read btsnoop header
@@ -316,6 +629,15 @@ class ADBCore(InternalBlue):
             self.s_inject = self.s_snoop = None
             self.device().killforward_all()
             return False
+
+        # From now on, the socket is in blocking mode. _recvRecordPart() only receives
+        # after the selector reported it readable, so it never blocks in recv_into()
+        # and waiting on the selector can be interrupted by shutdown().
+        self.s_snoop.settimeout(None)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.s_snoop, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
         return True
 
     def _teardownSockets(self):
@@ -329,17 +651,39 @@ class ADBCore(InternalBlue):
         if self.s_snoop != None:
             self.s_snoop.close()
             self.s_snoop = None
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        if self._wake_r is not None:
+            self._wake_r.close()
+            self._wake_w.close()
+            self._wake_r = self._wake_w = None
 
         if self.hciport is not None:
             hciport = self.hciport
             self.device().killforward_all()
 
-    def _spawn(self, cmd: str):
+    def shutdown(self):
+        # Wake up the recvThread, which blocks until s_snoop becomes readable
+        self.exit_requested = True
+        if self._wake_w is not None:
+            self._wake_w.send(b"\x00")
+        super(ADBCore, self).shutdown()
+
+        # Closing the connections terminates the processes spawned by _setupSerialSu()
+        for conn in self._serialConnections:
+            conn.close()
+        self._serialConnections = []
+
+    def _spawn(self, cmd: str) -> Connection:
+        """
+        Run cmd on the device. The command runs until the returned connection is closed.
+        """
+
         conn: Connection = self.device().create_connection()
         cmd = "exec:{}".format(cmd)
         conn.send(cmd)
-        while True:
-            sleep(1)
+        return conn
 
     def _setupSerialSu(self):
         """
@@ -355,7 +699,8 @@ class ADBCore(InternalBlue):
         Locations of the Bluetooth serial interface and btsnoop log file might differ.
         The second part *could* be combined, but it somehow does not work (SELinux?).
 
-        The ADB Python bindings will kill the processes automatically :)
+        The processes run as long as their adb connections are open, which are
+        closed again in shutdown().
 
         """
 
@@ -394,9 +739,11 @@ class ADBCore(InternalBlue):
             return False
 
         # spawn processes
-        threading.Thread(target=self._spawn, args=(f"su -c \"tail -f -n +0 {logfile} | nc -l -p 8872\"",)).start()
-        threading.Thread(target=self._spawn, args=(f"su -c \"nc -l -p 8873 >/sdcard/internalblue_input.bin\"",)).start()
-        threading.Thread(target=self._spawn, args=(f"su -c \"tail -f /sdcard/internalblue_input.bin >>{interface}\"",)).start()
+        self._serialConnections.extend(self._spawn(cmd) for cmd in (
+            f"su -c \"tail -f -n +0 {logfile} | nc -l -p 8872\"",
+            f"su -c \"nc -l -p 8873 >/sdcard/internalblue_input.bin\"",
+            f"su -c \"tail -f /sdcard/internalblue_input.bin >>{interface}\"",
+        ))
         sleep(2)
 
         return True
@@ -51,7 +51,7 @@ from .utils.packing import p8, p16, u16, p32, u32, bits, unbits
 from .utils.internalblue_logger import getInternalBlueLogger
 
 try:
-    from typing import List, Optional, Any, TYPE_CHECKING, Tuple, Union, NewType, Callable, cast
+    from typing import List, Optional, Any, TYPE_CHECKING, Tuple, Union, NewType, Callable, Iterable, cast
     from internalblue import (Address, Record, Task, HCI_CMD, FilterFunction, ConnectionNumber, ConnectionDict,
                               ConnectionIndex, BluetoothAddress, HeapInformation, QueueInformation, Opcode)
     from . import DeviceTuple
@@ -375,7 +375,8 @@ class InternalBlue(with_metaclass(ABCMeta, object)):
 
             # Send command to the chip using s_inject socket
             try:
-                self.logger.debug("_sendThreadFunc: Send: " + bytes_to_hex(out))
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("_sendThreadFunc: Send: %s", bytes_to_hex(out))
                 self.s_inject.send(out)
             except socket.error:
                 # TODO: For some reason this was required for proper save and replay, so this should be handled globally somehow. Or by implementing proper testing instead of the save/replay hack
@@ -781,8 +782,8 @@ class InternalBlue(with_metaclass(ABCMeta, object)):
         self.exit_requested = False
         self.logger.info("Shutdown complete.")
 
-    def registerHciCallback(self, callback):
-        # type: (Callable[[Record], None ]) -> None
+    def registerHciCallback(self, callback, inline=True):
+        # type: (Callable[[Record], None ], bool) -> None
         """
         Add a new callback function to self.registeredHciCallbacks.
         The function will be called every time the recvThread receives
@@ -793,7 +794,14 @@ class InternalBlue(with_metaclass(ABCMeta, object)):
         - inc_len
         - flags
         - drops
-        - timestamp (python datetime object)
+        - timestamp (python datetime object; ADBCore passes an object that
+          forwards attribute access, comparisons and hashing to the datetime,
+          its .value is the datetime itself or None if the timestamp is invalid)
+
+        If inline is False, the callback may be called from a worker thread
+        instead of the recvThread, so that a slow callback does not stall
+        receiving. Only ADBCore does that; the other cores ignore inline and
+        always call the callback from their recvThread.
         """
 
         if callback in self.registeredHciCallbacks:
@@ -812,8 +820,8 @@ class InternalBlue(with_metaclass(ABCMeta, object)):
             return
         self.logger.warning("registerHciCallback: no such callback is registered!")
 
-    def registerHciRecvQueue(self, queue, filter_function=None):
-        # type: (queue2k.Queue[Record], FilterFunction) -> None
+    def registerHciRecvQueue(self, queue, filter_function=None, hci_types=None):
+        # type: (queue2k.Queue[Record], FilterFunction, Optional[Iterable[int]]) -> None
         """
         Add a new queue to self.registeredHciRecvQueues.
         The queue will be filled by the recvThread every time the thread receives
@@ -823,16 +831,23 @@ class InternalBlue(with_metaclass(ABCMeta, object)):
         - inc_len
         - flags
         - drops
-        - timestamp (python datetime object)
+        - timestamp (python datetime object; ADBCore passes an object that
+          forwards attribute access, comparisons and hashing to the datetime,
+          its .value is the datetime itself or None if the timestamp is invalid)
 
         If filter_function is not None, the tuple will first be passed
         to the function and only if the function returns True, the packet
         is put into the queue.
+
+        If hci_types is not None, only packets of these HCI packet types
+        (e.g. HCI.HCI_EVT) are put into the queue (and passed to filter_function).
         """
 
         if queue in self.registeredHciRecvQueues:
             self.logger.warning("registerHciRecvQueue: queue already registered!")
             return
+        if hci_types is not None:
+            filter_function = hci.HciTypeFilter(hci_types, filter_function)
         self.registeredHciRecvQueues.append((queue, filter_function))
 
     def unregisterHciRecvQueue(self, queue):
@@ -1113,15 +1128,13 @@ class InternalBlue(with_metaclass(ABCMeta, object)):
         def hciFilterFunction(record):
             # type: (Record) -> bool
             hcipkt = record[0]
-            if not issubclass(hcipkt.__class__, hci.HCI_Event):
-                return False
             if hcipkt.event_code != 0xFF:
                 return False
             if hcipkt.data[0:4] != bytes("READ", "utf-8"):
                 return False
             return True
 
-        self.registerHciRecvQueue(recvQueue, hciFilterFunction)
+        self.registerHciRecvQueue(recvQueue, hciFilterFunction, hci_types=(HCI.HCI_EVT,))
 
         read_addr = address
         byte_counter = 0
@@ -35,7 +35,7 @@ from enum import Enum
 
 from internalblue.utils import flat
 from internalblue.utils.internalblue_logger import getInternalBlueLogger
-from internalblue.utils.packing import p8, u8, p16, u16, p32, u32, bits, unbits, bits_str
+from internalblue.utils.packing import p8, u8, p16, u16, p32, u32, bits, unbits
 
 
 class HCI_COMND(Enum):
@@ -648,9 +648,12 @@ class HCI_Acl(HCI):
     @staticmethod
     def from_data(data):
         data = bytes(data)  # bytearray to bytes
-        handle = u16(unbits(bits_str(data[0:2])[0:12].rjust(16, "0")))
-        bp = u8(unbits(bits_str(data[1:2])[4:6].rjust(8, "0")))
-        bc = u8(unbits(bits_str(data[1:2])[6:8].rjust(8, "0")))
+        # The handle is the upper 12 bits of the first two bytes, stored with
+        # its two bytes swapped (as getRaw() expects it). bp and bc are the
+        # two 2-bit flags in the lower nibble of the second byte.
+        handle = ((data[0] >> 4) | (data[0] << 12) | (data[1] >> 4 << 8)) & 0xFFFF
+        bp = (data[1] >> 2) & 0x03
+        bc = data[1] & 0x03
         return HCI_Acl(handle, bp, bc, u16(data[2:4]), data[4:])
 
     def getRaw(self):
@@ -673,9 +676,10 @@ class HCI_Sco(HCI):
     @staticmethod
     def from_data(data):
         data = bytes(data)  # bytearray to bytes
-        handle = u16(unbits(bits_str(data[0:2])[0:12].rjust(16, "0")))
-        ps = u8(unbits(bits_str(data[1:2])[4:6].rjust(8, "0")))
-        return HCI_Sco(handle, ps, u8(data[2]), data[3:])
+        # Same handle layout as in HCI_Acl.from_data()
+        handle = ((data[0] >> 4) | (data[0] << 12) | (data[1] >> 4 << 8)) & 0xFFFF
+        ps = (data[1] >> 2) & 0x03
+        return HCI_Sco(handle, ps, data[2], data[3:])
 
     def getRaw(self):
         raw = bits(p16(self.handle))[4:]
@@ -952,6 +956,25 @@ def parse_hci_packet(data):
     return HCI.from_data(data)
 
 
+class HciTypeFilter(object):
+    """
+    Filter function for InternalBlue.registerHciRecvQueue() which only accepts
+    packets of the given HCI packet types (HCI.HCI_CMD, HCI.ACL_DATA, ...) and
+    optionally passes them on to another filter function. Receive threads that
+    know about it can look up queues by packet type instead of calling it for
+    every packet.
+    """
+
+    def __init__(self, hci_types, filter_function=None):
+        self.hci_types = frozenset(hci_types)
+        self.filter_function = filter_function
+
+    def __call__(self, record):
+        if record[0].uart_type not in self.hci_types:
+            return False
+        return self.filter_function is None or self.filter_function(record)
+
+
 class StackDumpReceiver(object):
     memdump_addr = None
     memdumps = {}
@@ -30,6 +30,22 @@ class SocketRecvHook(object):
         self.recv_hook(data)
         return data
 
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        # Receives via recv() so that hooks and replays also see recv_into() calls.
+        # Flags are only passed on to a real socket, not to recv_replace().
+        view = memoryview(buffer)
+        nbytes = nbytes or len(view)
+        if not self.replace:
+            data = self.snoop_socket.recv(nbytes, flags)
+        else:
+            data = self.recv_replace(nbytes)
+        self.recv_hook(data)
+        view[: len(data)] = data
+        return len(data)
+
+    def fileno(self):
+        return self.snoop_socket.fileno()
+
     def recvfrom_replace(self, length, **kwargs):
         raise NotImplementedError("recvfrom_replace not implemented")
 
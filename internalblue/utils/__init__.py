@@ -5,8 +5,8 @@ from internalblue import Address
 
 
 def bytes_to_hex(data):
-    # type: (Union[bytes, bytearray]) -> str
-    return "".join(format(x, "02x") for x in bytearray(data))
+    # type: (Union[bytes, bytearray, memoryview]) -> str
+    return memoryview(data).hex()
 
 
 def flat(data: [Address, bytes], filler: int) -> bytes:
@@ -0,0 +1,114 @@
+from __future__ import print_function
+import internalblue.adbcore
+from internalblue.adbcore import ADBCore
+from internalblue.hcicore import HCICore
+
+import selectors
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+EVENT = b"\x04\x0e\x04\x01\x01\x10\x00"
+
+
+def _record(hci_packet):
+    return struct.pack(">IIIIq", len(hci_packet), len(hci_packet), 1, 0, 0x00E03AB44A676000) + hci_packet
+
+
+def _start_recv_thread(core):
+    # Connect the recvThread to a socketpair instead of the adb forward
+    core.s_snoop, remote = socket.socketpair()
+    core._wake_r, core._wake_w = socket.socketpair()
+    core._selector = selectors.DefaultSelector()
+    core._selector.register(core.s_snoop, selectors.EVENT_READ)
+    core._selector.register(core._wake_r, selectors.EVENT_READ)
+    thread = threading.Thread(target=core._recvThreadFunc)
+    thread.start()
+    return remote, thread
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _run_deferred(send_records):
+    data_directory = tempfile.mkdtemp()
+    try:
+        core = ADBCore(data_directory=data_directory)
+        inline_records = []
+        core.registerHciCallback(inline_records.append)
+        remote, thread = _start_recv_thread(core)
+        try:
+            send_records(core, remote, inline_records)
+        finally:
+            remote.close()
+            thread.join(5)
+        assert not thread.is_alive()
+        core.btsnooplog_file.close()
+    finally:
+        shutil.rmtree(data_directory)
+
+
+def test_deferred_callback():
+    deferred = []
+
+    def callback(record):
+        deferred.append((record[0].getRaw(), threading.current_thread()))
+
+    def send_records(core, remote, inline_records):
+        core.registerHciCallback(callback, inline=False)
+        for i in range(10):
+            remote.sendall(_record(EVENT[:-1] + bytes([i])))
+        _wait_for(lambda: len(deferred) == 10)
+
+    _run_deferred(send_records)
+    assert [raw for raw, _ in deferred] == [EVENT[:-1] + bytes([i]) for i in range(10)]
+    assert all(thread is not threading.current_thread() for _, thread in deferred)
+
+
+def test_deferred_callback_drops_when_behind():
+    started = threading.Event()
+    release = threading.Event()
+    deferred = []
+
+    def callback(record):
+        started.set()
+        release.wait(5)
+        deferred.append(record[0].getRaw())
+
+    def send_records(core, remote, inline_records):
+        core.registerHciCallback(callback, inline=False)
+        remote.sendall(_record(EVENT[:-1] + b"\x00"))
+        assert started.wait(5)
+        for i in range(1, 6):
+            remote.sendall(_record(EVENT[:-1] + bytes([i])))
+        # The recvThread keeps receiving while the deferred callback blocks
+        _wait_for(lambda: len(inline_records) == 6)
+        release.set()
+        _wait_for(lambda: len(deferred) == 3)
+
+    queue_size = internalblue.adbcore._DEFERRED_CALLBACK_QUEUE_SIZE
+    internalblue.adbcore._DEFERRED_CALLBACK_QUEUE_SIZE = 2
+    try:
+        _run_deferred(send_records)
+    finally:
+        internalblue.adbcore._DEFERRED_CALLBACK_QUEUE_SIZE = queue_size
+        release.set()
+    # The first record was being processed, two were queued, the rest dropped
+    assert deferred == [EVENT[:-1] + bytes([i]) for i in range(3)]
+
+
+def test_inline_ignored_by_other_cores():
+    data_directory = tempfile.mkdtemp()
+    try:
+        core = HCICore(data_directory=data_directory)
+        core.registerHciCallback(print, inline=False)
+        assert print in core.registeredHciCallbacks
+    finally:
+        shutil.rmtree(data_directory)
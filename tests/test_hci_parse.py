@@ -0,0 +1,37 @@
+from __future__ import print_function
+from internalblue.hci import HCI, HCI_Acl, HCI_Sco
+from internalblue.utils.packing import bits_str, unbits, u8, u16
+
+
+def _old_acl_header(d):
+    # ACL header parsing as it was done with bits_str/unbits before HCI_Acl.from_data
+    # switched to shifts and masks
+    handle = u16(unbits(bits_str(d[0:2])[0:12].rjust(16, "0")))
+    bp = u8(unbits(bits_str(d[1:2])[4:6].rjust(8, "0")))
+    bc = u8(unbits(bits_str(d[1:2])[6:8].rjust(8, "0")))
+    return handle, bp, bc
+
+
+def test_acl_header_matches_old_parsing():
+    for b0 in range(256):
+        for b1 in range(256):
+            d = bytes([b0, b1])
+            acl = HCI_Acl.from_data(d + b"\x00\x00")
+            assert (acl.handle, acl.bp, acl.bc) == _old_acl_header(d), d.hex()
+
+
+def test_acl_roundtrip():
+    raw = b"\x02\x0b\x20\x05\x00\x01\x00\x00\x00\x00"
+    acl = HCI.from_data(raw)
+    assert isinstance(acl, HCI_Acl)
+    assert acl.getRaw() == raw
+
+
+def test_sco_parse():
+    sco = HCI.from_data(bytearray(b"\x03\x0b\x2c\x02ab"))
+    assert isinstance(sco, HCI_Sco)
+    handle, ps, _ = _old_acl_header(b"\x0b\x2c")
+    assert sco.handle == handle
+    assert sco.ps == ps == 3
+    assert sco.length == 2
+    assert sco.data == b"ab"
@@ -0,0 +1,54 @@
+from __future__ import print_function
+from internalblue.adbcore import ADBCore
+from internalblue.hci import HCI, HCI_Cmd, HCI_Event, HciTypeFilter
+
+import queue
+import shutil
+import tempfile
+
+
+def _record(hcipkt):
+    return (hcipkt, 0, 0, 0, 0, None)
+
+
+def test_hci_type_filter():
+    evt = _record(HCI_Event(0x0E, 0, b""))
+    cmd = _record(HCI_Cmd(0x0C03, 0, b""))
+
+    type_filter = HciTypeFilter((HCI.HCI_EVT,))
+    assert type_filter(evt)
+    assert not type_filter(cmd)
+
+    calls = []
+
+    def reject(record):
+        calls.append(record)
+        return False
+
+    chained = HciTypeFilter((HCI.HCI_EVT,), reject)
+    assert not chained(evt)
+    assert not chained(cmd)
+    # The chained filter only sees packets of the listed types
+    assert calls == [evt]
+
+
+def test_recv_dispatch_by_type():
+    data_directory = tempfile.mkdtemp()
+    try:
+        core = ADBCore(data_directory=data_directory)
+        typed_queue = queue.Queue()
+        plain_queue = queue.Queue()
+
+        core.registerHciRecvQueue(typed_queue, hci_types=(HCI.HCI_EVT,))
+        core.registerHciRecvQueue(plain_queue)
+        filtered_queues, queues_by_type = core._hciRecvDispatch
+        assert list(queues_by_type) == [HCI.HCI_EVT]
+        assert [q for q, _ in queues_by_type[HCI.HCI_EVT]] == [typed_queue]
+        assert [q for q, _ in filtered_queues] == [plain_queue]
+
+        core.unregisterHciRecvQueue(typed_queue)
+        filtered_queues, queues_by_type = core._hciRecvDispatch
+        assert queues_by_type == {}
+        assert [q for q, _ in filtered_queues] == [plain_queue]
+    finally:
+        shutil.rmtree(data_directory)
@@ -0,0 +1,53 @@
+from __future__ import print_function
+from internalblue.adbcore import _LazyTime
+
+import copy
+import datetime
+import pickle
+
+# 2000-01-01 00:00:00 in btsnoop microseconds
+EPOCH_2000 = 0x00E03AB44A676000
+
+
+def test_lazy_time_value():
+    t = _LazyTime(EPOCH_2000 + 1500000)
+    assert t.value == datetime.datetime(2000, 1, 1, 0, 0, 1, 500000)
+    assert t.second == 1
+    assert t.microsecond == 500000
+    assert t
+
+    invalid = _LazyTime(1 << 62)
+    assert invalid.value is None
+    assert not invalid
+
+
+def test_lazy_time_copy_and_pickle():
+    t = _LazyTime(EPOCH_2000)
+    for clone in (copy.copy(t), copy.deepcopy(t), pickle.loads(pickle.dumps(t))):
+        assert isinstance(clone, _LazyTime)
+        assert clone.value == t.value
+
+
+def test_lazy_time_private_attributes():
+    t = _LazyTime.__new__(_LazyTime)
+    try:
+        t._parsed
+    except AttributeError:
+        pass
+    else:
+        assert False, "private attributes must not be forwarded"
+
+
+def test_lazy_time_compare_and_hash():
+    a = _LazyTime(EPOCH_2000)
+    b = _LazyTime(EPOCH_2000)
+    later = _LazyTime(EPOCH_2000 + 1)
+    dt = datetime.datetime(2000, 1, 1)
+
+    assert a == b
+    assert a == dt and dt == a
+    assert a != later
+    assert a < later and later > a
+    assert a <= b and dt < later
+    assert hash(a) == hash(b) == hash(dt)
+    assert len({a, b, dt}) == 1